@@ -1,14 +1,101 @@
 import streamlit as st
 import os
-import json
-import queue
+import orjson
+import unicodedata
 import vosk
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 import sounddevice as sd
 import boto3
 import numpy as np
-from fuzzywuzzy import fuzz
+from rapidfuzz import fuzz, process
 from botocore.exceptions import NoCredentialsError
 
+# Per-language resources; only the active language is ever loaded
+MODEL_PATHS = {
+    "pt-BR": os.path.join("models", "pt-BR"),
+    "es-ES": os.path.join("models", "es-ES"),
+    "it-IT": os.path.join("models", "it-IT"),  # Italian model
+}
+GRAMMAR_FILES = {
+    "pt-BR": "models/br_names.txt",
+    "es-ES": "models/es_names.txt",
+    "it-IT": "models/it_names.txt",  # Italian names
+}
+DID_YOU_SAY = {
+    "pt-BR": "Você disse",
+    "es-ES": "Dijiste",
+    "it-IT": "Hai detto",
+}
+
+# int16 RMS below which a block counts as silence (ajusta según el ruido ambiental)
+SILENCE_RMS_THRESHOLD = 300
+
+
+def _fold_name(name):
+    """
+    Lowercase a name and strip diacritics for duplicate comparisons.
+
+    Args:
+        name (str): Name as written.
+
+    Returns:
+        str: Accent-folded, lowercased name.
+    """
+    decomposed = unicodedata.normalize("NFKD", name)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+@st.cache_resource
+def get_polly_client():
+    """
+    Create the AWS Polly client once per process.
+
+    Returns:
+        botocore.client.BaseClient: Shared Polly client.
+    """
+    return boto3.Session().client("polly", region_name="us-east-1")
+
+
+@st.cache_resource
+def load_vosk_model(model_path):
+    """
+    Load the Vosk model from the specified path, once per process.
+
+    Args:
+        model_path (str): Path to the Vosk model directory.
+
+    Returns:
+        vosk.Model: Loaded Vosk model.
+    """
+    if not os.path.exists(model_path):
+        print(f"Models not found in {model_path}")
+        st.error("Models not found")
+        st.stop()
+    return vosk.Model(model_path)
+
+
+@st.cache_data
+def load_grammar(file_path):
+    """
+    Load grammar from a file containing a list of words.
+
+    Args:
+        file_path (str): Path to the file containing the word list.
+
+    Returns:
+        str: JSON string representing the grammar.
+    """
+    if not os.path.exists(file_path):
+        st.error(f"Names files {file_path} not found!")
+        st.stop()
+    # Binary read skips the text-mode decode of the whole buffer; lines are
+    # split on bytes and only decoded individually
+    with open(file_path, 'rb') as file:
+        words = [line.decode("utf-8") for line in file.read().splitlines()]
+    return orjson.dumps(words).decode()  # Correct format
+
+
 class VoiceRecognitionApp:
     """
     A class to represent a voice recognition application using Vosk and AWS Polly.
@@ -21,96 +108,119 @@ class VoiceRecognitionApp:
         """
         # For future implementations
         self.language_choice = None
-        session = boto3.Session()
-        self.polly_client = session.client("polly", region_name="us-east-1")
+        self.polly_client = get_polly_client()
+
+        # Only the active language's model and grammar are loaded; the cached
+        # loaders keep anything already seen alive for instant switching back.
+        self.model = None
+        self.grammar = None
+        self.set_language("es-ES")
 
-        # Set my models path
-        self.br_model = self.load_vosk_model(os.path.join("models", "pt-BR"))
-        self.es_model = self.load_vosk_model(os.path.join("models", "es-ES"))
-        self.it_model = self.load_vosk_model(os.path.join("models", "it-IT"))  # Italian model
+        self.sample_rate = 16000
 
-        # default models
-        self.model = self.es_model
+        # Recognizers are expensive to build (grammar FST), so keep them around
+        self._rec_cache = {}
 
-        # Load my custom names
-        self.br_names = self.load_grammar("models/br_names.txt")
-        self.es_names = self.load_grammar("models/es_names.txt")
-        self.it_names = self.load_grammar("models/it_names.txt")  # Italian names
+        # Polly voice listings per language, to skip repeat DescribeVoices calls
+        self._voices_cache = {}
 
-        # Load the default names
-        self.grammar = self.es_names
+        # Lowercased name sets per grammar file, so dedup checks don't
+        # re-read and rebuild the whole list on every update
+        self._names_cache = {}
 
-        self.sample_rate = 16000
+        # Single worker for Polly calls, so TTS network I/O overlaps with
+        # recognition and UI rendering instead of blocking them
+        self._tts_executor = ThreadPoolExecutor(max_workers=1)
 
-    @staticmethod
-    def load_vosk_model(model_path):
+    def _known_names(self, grammar_file):
         """
-        Load the Vosk model from the specified path.
+        Return the persistent set of folded names for a grammar file.
 
         Args:
-            model_path (str): Path to the Vosk model directory.
+            grammar_file (str): Path to the grammar word list.
 
         Returns:
-            vosk.Model: Loaded Vosk model.
+            set: Accent-folded, lowercased names currently in the file.
+        """
+        names = self._names_cache.get(grammar_file)
+        if names is None:
+            with open(grammar_file, 'rb') as file:
+                names = {_fold_name(line.decode("utf-8")) for line in file.read().splitlines()}
+            self._names_cache[grammar_file] = names
+        return names
+
+    def set_language(self, language_choice):
+        """
+        Activate a language, lazily loading its model and grammar.
+
+        Args:
+            language_choice (str): Language code, e.g. "es-ES".
         """
-        if not os.path.exists(model_path):
-            print(f"Models not found in {model_path}")
-            st.error("Models not found")
-            st.stop()
-        return vosk.Model(model_path)
-
-    @staticmethod
-    def load_grammar(file_path):
+        if language_choice == self.language_choice:
+            return
+        self.language_choice = language_choice
+        self.model = load_vosk_model(MODEL_PATHS[language_choice])
+        self.grammar = load_grammar(GRAMMAR_FILES[language_choice])
+
+    def _get_recognizer(self, sample_rate):
         """
-        Load grammar from a file containing a list of words.
+        Return a cached KaldiRecognizer for the current model/grammar.
 
         Args:
-            file_path (str): Path to the file containing the word list.
+            sample_rate (int): Sample rate the recognizer is built for.
 
         Returns:
-            str: JSON string representing the grammar.
+            vosk.KaldiRecognizer: Ready-to-use recognizer, reset between calls.
         """
-        if not os.path.exists(file_path):
-            st.error(f"Names files {file_path} not found!")
-            st.stop()
-        with open(file_path, 'r') as file:
-            words = file.read().splitlines()
-        return json.dumps(words)  # Correct format
-
-    def recognize_speech(self, sample_rate=16000, block_size=8000):
+        key = (self.language_choice, sample_rate, hash(self.grammar))
+        rec = self._rec_cache.get(key)
+        if rec is None:
+            rec = vosk.KaldiRecognizer(self.model, sample_rate, self.grammar)
+            self._rec_cache[key] = rec
+        else:
+            rec.Reset()
+        return rec
+
+    def recognize_speech(self, sample_rate=16000, block_size=4096):
         """
         Record and transcribe speech using multiple Vosk models with custom grammar.
 
         Args:
             sample_rate (int): Sample rate for audio recording
-            block_size (int): Block size for audio processing
+            block_size (int): Block size for audio processing (power of two)
 
         Returns:
             str: Recognized text from the speech.
         """
-        q = queue.Queue(maxsize=1)
-
-        def callback(indata, frames, time, status):
-            if status:
-                st.error(status)
-            q.put(bytes(indata))
-
-        # Initialize recognizer
+        # Blocking reads from the main thread: no callback thread, no queue
+        # hand-off, and 'low' latency asks PortAudio for minimal buffering.
         with sd.RawInputStream(samplerate=sample_rate, blocksize=block_size, dtype='int16',
-                               channels=1, callback=callback):
+                               channels=1, latency='low') as stream:
             message_placeholder = st.empty()
             message_placeholder.write("🎤 Listening... Speak now")  # Mensaje temporal
             # self.msg_listening = "Listening... Speak now"
             # st.write(f"""{self.msg_listening}""")
-            rec = vosk.KaldiRecognizer(self.model, sample_rate, self.grammar)
-            rec.energy_threshold = 300  # Ajusta este valor según el ruido ambiental
-            rec.dynamic_energy_threshold = True  # Permite ajustes automatizados
+            rec = self._get_recognizer(sample_rate)
+            speech_started = False
 
             while True:
-                data = q.get()
-                if rec.AcceptWaveform(data):
+                data, overflowed = stream.read(block_size)
+                if overflowed:
+                    st.error("Audio input overflow")
+                # Zero-copy int16 view over the cffi buffer; tobytes() is the
+                # single memcpy on the audio path, with the dtype handled in C.
+                samples = np.frombuffer(data, dtype=np.int16)
+                if not speech_started:
+                    # Gate only leading silence. Once speech starts every block
+                    # goes through, so Vosk's silence-based endpointing can
+                    # still finalize the utterance.
+                    rms = np.sqrt(np.mean(samples.astype(np.float32) ** 2))
+                    if rms < SILENCE_RMS_THRESHOLD:
+                        continue
+                    speech_started = True
+                if rec.AcceptWaveform(samples.tobytes()):
                     message_placeholder.empty()
-                    result = json.loads(rec.Result())
+                    result = orjson.loads(rec.Result())
                     return result.get("text", "")
 
     def synthesize_speech(self, text, slow=False) -> bytes:
@@ -125,9 +235,12 @@ class VoiceRecognitionApp:
             bytes: Audio data in bytes.
         """
         try:
-            # Get available voices for the specified language
-            voices_response = self.polly_client.describe_voices(LanguageCode=self.language_choice)
-            voices = voices_response.get("Voices", [])
+            # Get available voices for the specified language (cached per language)
+            voices = self._voices_cache.get(self.language_choice)
+            if voices is None:
+                voices_response = self.polly_client.describe_voices(LanguageCode=self.language_choice)
+                voices = voices_response.get("Voices", [])
+                self._voices_cache[self.language_choice] = voices
 
             if not voices:
                 raise ValueError(f"No voices found for language: {self.language_choice}")
@@ -149,23 +262,38 @@ class VoiceRecognitionApp:
                 engine = "standard"
 
             # Synthesize speech
-            if self.language_choice == "pt-BR":
-                text = text.replace("Did you say", "Você disse")
-            elif self.language_choice == "es-ES":
-                text = text.replace("Did you say", "Dijiste")
-            elif self.language_choice == "it-IT":
-                text = text.replace("Did you say", "Hai detto")
+            translation = DID_YOU_SAY.get(self.language_choice)
+            if translation:
+                text = text.replace("Did you say", translation)
 
+            # MP3 for browser playback via st.audio; raw PCM would ship ~8x
+            # more bytes to the client for no decode saving there
             response = self.polly_client.synthesize_speech(
                 Text=text,
                 OutputFormat="mp3",
                 VoiceId=selected_voice,
                 Engine=engine if not slow else "standard"
             )
-            return response["AudioStream"].read()
+            # Drain the stream in chunks instead of one giant read, so the
+            # socket buffer is released steadily and the body is closed.
+            with closing(response["AudioStream"]) as audio_stream:
+                return b"".join(iter(lambda: audio_stream.read(4096), b""))
         except Exception as e:
             print(f"Polly Error: {e}")
 
+    def synthesize_speech_async(self, text, slow=False):
+        """
+        Run synthesize_speech on the background worker.
+
+        Args:
+            text (str): Text to be synthesized.
+            slow (bool): Whether to use slow mode for speech synthesis.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the audio bytes.
+        """
+        return self._tts_executor.submit(self.synthesize_speech, text, slow)
+
     def update_grammar(self, new_text):
         """
         Update the grammar file with new text for model improvement.
@@ -173,45 +301,39 @@ class VoiceRecognitionApp:
         Args:
             new_text (str): New text to add to the grammar
         """
-        if self.language_choice == "es-ES":
-            grammar_file = "models/es_names.txt"
-        elif self.language_choice == "it-IT":
-            grammar_file = "models/it_names.txt"
-        else:
-            grammar_file = "models/br_names.txt"
-
-        # Read existing grammar
-        with open(grammar_file, 'r') as file:
-            existing_words = set(file.read().splitlines())
-
-        # Add new text if it's not already present
-        if new_text.strip().lower() not in {word.lower() for word in existing_words}:
+        grammar_file = GRAMMAR_FILES.get(self.language_choice, "models/br_names.txt")
+
+        # Add new text if it's not already present: the names are compared
+        # accent-folded, so "García" vs "Garcia" is an exact hit, and the
+        # fuzzy screen then rejects near-identical spellings such as a
+        # one-letter addition to a longer name ("Silva" vs "Silvas")
+        new_name = new_text.strip()
+        new_folded = _fold_name(new_name)
+        known_names = self._known_names(grammar_file)
+        is_duplicate = new_folded in known_names or process.extractOne(
+            new_folded, known_names, scorer=fuzz.WRatio, score_cutoff=90) is not None
+        if not is_duplicate:
             with open(grammar_file, 'a') as file:
-                file.write(f"\n{new_text.strip()}")
-
-            # Reload grammar
-            if self.language_choice == "es-ES":
-                self.grammar = self.load_grammar("models/es_names.txt")
-            elif self.language_choice == "it-IT":
-                self.grammar = self.load_grammar("models/it_names.txt")
-            else:
-                self.grammar = self.load_grammar("models/br_names.txt")
+                file.write(f"\n{new_name}")
+            known_names.add(new_folded)
+
+            # Extend the in-memory word list and re-encode it, instead of
+            # re-reading the file we just appended to. Drop the cached JSON
+            # so a later reload from disk also sees the new name.
+            load_grammar.clear()
+            words = orjson.loads(self.grammar)
+            words.append(new_name)
+            self.grammar = orjson.dumps(words).decode()
             return True
         return True
 
     def reset_session(self):
         """
-        Reset all session state variables to their initial values
+        Reset the recognition session state variables to their initial values
         """
-        # First, store any values we need to preserve
-        language_choice = getattr(st.session_state, 'language_choice', 'es-ES')
-
-        # Clear all session state
-        for key in list(st.session_state.keys()):
-            del st.session_state[key]
-
-        # Restore preserved values and set initial states
-        st.session_state.language_choice = language_choice
+        # Only touch the recognition keys; language_choice and any other
+        # state (including widget state) survive the reset
+        st.session_state.pop("manual_input", None)
         st.session_state.current_cycle = 0
         st.session_state.recognition_active = False
         st.session_state.show_manual_input = False
@@ -234,8 +356,8 @@ class VoiceRecognitionApp:
         if 'manual_submitted' not in st.session_state:
             st.session_state.manual_submitted = False
 
-        self.language_choice = st.selectbox("Select language model", ["es-ES", "pt-BR", "it-IT"], index=0)
-        st.session_state.language_choice = self.language_choice
+        language_choice = st.selectbox("Select language model", ["es-ES", "pt-BR", "it-IT"], index=0)
+        st.session_state.language_choice = language_choice
 
         speak_slower_msg = """
             **Try one of the following options:**
@@ -244,21 +366,13 @@ class VoiceRecognitionApp:
             3. Change the base language according to the origin of the last name
             """
 
-        if self.language_choice == "pt-BR" and self.model != self.br_model:
-            self.model = self.br_model
-            self.grammar = self.br_names
-        elif self.language_choice == "es-ES" and self.model != self.es_model:
-            self.model = self.es_model
-            self.grammar = self.es_names
-        elif self.language_choice == "it-IT" and self.model != self.it_model:
-            self.model = self.it_model
-            self.grammar = self.it_names
+        self.set_language(language_choice)
 
         # Define recognition cycles with different parameters
         recognition_cycles = [
-            {"sample_rate": 16000, "block_size": 2048},
-            {"sample_rate": 32000, "block_size": 4096},
-            {"sample_rate": 44100, "block_size": 8192}
+            {"sample_rate": 16000, "block_size": 1024},
+            {"sample_rate": 32000, "block_size": 2048},
+            {"sample_rate": 44100, "block_size": 4096}
         ]
 
         # Place Start Recognition and Reset buttons side by side
@@ -318,9 +432,18 @@ class VoiceRecognitionApp:
                     block_size=params["block_size"]
                 )
 
-                # Take last words of text to be the last name
-                words = recognized_text.split()
-                last_name = " ".join(words[-1:]) if len(words) >= 1 else recognized_text
+                # Take the last word of the text to be the last name
+                last_name = recognized_text.rstrip().rpartition(" ")[2] or recognized_text
+
+                # Snap the recognized last name to the closest grammar entry
+                names = orjson.loads(self.grammar)
+                match = process.extractOne(last_name, names, scorer=fuzz.WRatio, score_cutoff=80)
+                if match:
+                    last_name = match[0]
+
+                # Start the confirmation prompt synthesis now, so the Polly
+                # round-trip overlaps with rendering the results below
+                tts_future = self.synthesize_speech_async(f"Did you say {last_name}?")
 
                 # Display results in a formatted box
                 st.write("Recognition Results:")
@@ -331,6 +454,10 @@ Parameters Used:
     - Block Size: {params['block_size']}
     - Recognition Cycle: {current_cycle + 1} of {len(recognition_cycles)}""")
 
+                # Reserve a slot for the prompt audio; it is filled in last so
+                # nothing below waits on Polly
+                audio_placeholder = st.empty()
+
                 # Confirmation buttons
                 col1, col2 = st.columns(2)
                 with col1:
@@ -348,6 +475,27 @@ Parameters Used:
                             st.session_state.current_cycle += 1
                             # st.rerun()
 
+                # Everything is rendered and interactive by now; block on the
+                # remainder of the Polly round-trip only at the very end
+                audio_bytes = tts_future.result()
+                if audio_bytes:
+                    audio_placeholder.audio(audio_bytes, format="audio/mp3")
+
+@st.cache_resource
+def get_app():
+    """
+    Create the VoiceRecognitionApp once per process.
+
+    Streamlit re-executes the script on every widget interaction, so the
+    instance (and the recognizer/voice/name caches living on it) must be
+    cached to survive across reruns.
+
+    Returns:
+        VoiceRecognitionApp: Shared application instance.
+    """
+    return VoiceRecognitionApp()
+
+
 if __name__ == "__main__":
-    app = VoiceRecognitionApp()
+    app = get_app()
     app.run()